@@ -1,17 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 import os
+import asyncio
+import hashlib
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Union
+from enum import Enum
 import uuid
 from datetime import datetime, timedelta
+import time
 import jwt
 import bcrypt
+import orjson
+from cachetools import TTLCache
 from email_validator import validate_email, EmailNotValidError
 
 ROOT_DIR = Path(__file__).parent
@@ -19,16 +31,61 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAXPOOL', '50')),
+    minPoolSize=int(os.environ.get('MONGO_MINPOOL', '10')),
+    serverSelectionTimeoutMS=3000,
+    connectTimeoutMS=3000,
+    socketTimeoutMS=10000,
+    retryWrites=True,
+    compressors=os.environ.get('MONGO_COMPRESSORS', 'zstd,zlib'),
+)
 db = client[os.environ['DB_NAME']]
+# Set at startup, transactions need a replica set or mongos
+mongo_supports_transactions = False
+
+# Redis connection (optional, product caching falls back to the in-process tier)
+redis_url = os.environ.get('REDIS_URL')
+redis_client = Redis.from_url(redis_url) if redis_url else None
 
 # JWT settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-here')
+JWT_SECRET_BYTES = JWT_SECRET.encode('utf-8')
 JWT_ALGORITHM = "HS256"
+JWT_ALGORITHMS = [JWT_ALGORITHM]
+JWT_OPTIONS = {"require": ["exp", "sub"], "verify_signature": True}
+jwt_decoder = jwt.PyJWT()
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+# Verified token -> (User, exp) lookups, saves a decode and a Mongo round trip per request
+USER_CACHE_TTL_SECONDS = 300
+user_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
+
+# Logged-out tokens, token hash -> exp. Requests only check this in-process copy;
+# with Redis, revocations are kept in a sorted set and broadcast to every worker.
+revoked_tokens = {}
+REVOKED_TOKENS_KEY = "revoked_tokens"
+REVOKED_TOKENS_CHANNEL = "revoked_tokens"
+revocation_listener = None
+
+# Redis outages are logged at most once per interval for each kind of operation
+REDIS_WARNING_INTERVAL_SECONDS = 60
+redis_warning_last_logged = {}
+
+# Product caching: a short-lived in-process tier in front of Redis
+PRODUCT_LIST_CACHE_TTL_SECONDS = 60
+PRODUCT_CACHE_TTL_SECONDS = 300
+LOCAL_PRODUCT_CACHE_TTL_SECONDS = 10
+local_product_cache = TTLCache(maxsize=1_000, ttl=LOCAL_PRODUCT_CACHE_TTL_SECONDS)
+# Redis set of cached product list keys, so writes can drop them without a SCAN
+PRODUCT_LIST_KEYS = "products:keys"
+
+# Password hashing settings
+BCRYPT_COST = int(os.environ.get('BCRYPT_COST', '12'))
+
 # Create the main app without a prefix
-app = FastAPI(title="Hair Ecommerce API")
+app = FastAPI(title="Hair Ecommerce API", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -64,12 +121,23 @@ class UserResponse(BaseModel):
     created_at: datetime
     is_active: bool
 
+# Users are read from our own collection, responses are built without revalidating
+USER_RESPONSE_FIELDS = set(UserResponse.model_fields)
+
+class Category(str, Enum):
+    extensions = "extensions"
+    wigs = "wigs"
+    bundles = "bundles"
+    closures = "closures"
+    hair_care = "hair_care"
+    accessories = "accessories"
+
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     description: str
     price: float
-    category: str  # extensions, wigs, bundles, closures, hair_care, accessories
+    category: Category
     subcategory: Optional[str] = None
     images: List[str]
     attributes: dict = {}  # length, color, texture, etc.
@@ -77,11 +145,19 @@ class Product(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ProductSummary(BaseModel):
+    id: str
+    name: str
+    price: float
+    category: Category
+    images: List[str]  # first image only
+    stock_quantity: int
+
 class ProductCreate(BaseModel):
     name: str
     description: str
     price: float
-    category: str
+    category: Category
     subcategory: Optional[str] = None
     images: List[str]
     attributes: dict = {}
@@ -117,21 +193,143 @@ class OrderCreate(BaseModel):
 
 # Utility functions
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_COST)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+# Hashed once at startup, used to equalize login timing for unknown emails
+DUMMY_PASSWORD_HASH = hash_password(uuid.uuid4().hex)
+
+def needs_rehash(hashed: str) -> bool:
+    # bcrypt hashes look like $2b$12$..., the second field is the cost
+    try:
+        return int(hashed.split('$')[2]) < BCRYPT_COST
+    except (IndexError, ValueError):
+        return True
+
+async def rehash_password(user_id: str, password: str):
+    password_hash = await run_in_threadpool(hash_password, password)
+    await db.users.update_one({"id": user_id}, {"$set": {"password_hash": password_hash}})
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_BYTES, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+def log_redis_unavailable(action: str):
+    now = time.monotonic()
+    if now - redis_warning_last_logged.get(action, float('-inf')) >= REDIS_WARNING_INTERVAL_SECONDS:
+        redis_warning_last_logged[action] = now
+        logger.warning("Redis unavailable, %s", action)
+
+async def cache_get(key: str):
+    value = local_product_cache.get(key)
+    if value is not None or redis_client is None:
+        return value
+    try:
+        raw = await redis_client.get(key)
+    except RedisError:
+        log_redis_unavailable("skipping product cache reads")
+        return None
+    if raw is None:
+        return None
+    value = orjson.loads(raw)
+    local_product_cache[key] = value
+    return value
+
+async def cache_set(key: str, value, ttl: int, group: Optional[str] = None) -> dict:
+    # The weak ETag is computed once here and cached alongside the payload
+    etag = f'W/"{hashlib.md5(orjson.dumps(value), usedforsecurity=False).hexdigest()}"'
+    entry = {"etag": etag, "data": value}
+    local_product_cache[key] = entry
+    if redis_client is None:
+        return entry
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, ttl, orjson.dumps(entry))
+            if group:
+                pipe.sadd(group, key)
+            await pipe.execute()
+    except RedisError:
+        log_redis_unavailable("skipping product cache writes")
+    return entry
+
+async def invalidate_product_cache(product_id: Optional[str] = None):
+    keys = [key for key in list(local_product_cache.keys()) if key.startswith("products:")]
+    if product_id:
+        keys.append(f"product:{product_id}")
+    for key in keys:
+        local_product_cache.pop(key, None)
+    if redis_client is None:
+        return
+    try:
+        keys.extend(await redis_client.smembers(PRODUCT_LIST_KEYS))
+        keys.append(PRODUCT_LIST_KEYS)
+        await redis_client.delete(*keys)
+    except RedisError:
+        log_redis_unavailable("product cache not invalidated")
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def prune_revoked_tokens(now: float):
+    # Drop entries for tokens that have expired on their own
+    for revoked_key, revoked_exp in list(revoked_tokens.items()):
+        if revoked_exp <= now:
+            revoked_tokens.pop(revoked_key, None)
+
+async def revoke_token(token: str, exp: float):
+    key = token_key(token)
+    now = time.time()
+    prune_revoked_tokens(now)
+    revoked_tokens[key] = exp
+    user_cache.pop(token, None)
+    if redis_client is None:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(REVOKED_TOKENS_KEY, {key: exp})
+            pipe.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", now)
+            pipe.publish(REVOKED_TOKENS_CHANNEL, f"{key}:{exp}")
+            await pipe.execute()
+    except RedisError:
+        log_redis_unavailable("tokens revoked on this worker only")
+
+async def listen_for_revocations():
+    # Keeps revoked_tokens in sync with other workers, reconnecting after Redis errors
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(REVOKED_TOKENS_CHANNEL)
+                # Subscribed first, so nothing revoked while loading is missed
+                revoked = await redis_client.zrangebyscore(REVOKED_TOKENS_KEY, time.time(), "+inf", withscores=True)
+                for key, exp in revoked:
+                    revoked_tokens[key.decode()] = exp
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        key, exp = message["data"].decode().split(":")
+                        revoked_tokens[key] = float(exp)
+        except RedisError:
+            log_redis_unavailable("not receiving token revocations from other workers")
+            await asyncio.sleep(5)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    if token_key(token) in revoked_tokens:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    cached = user_cache.get(token)
+    if cached is not None:
+        user, exp = cached
+        if exp > time.time():
+            return user
+        user_cache.pop(token, None)
+    
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = jwt_decoder.decode(token, JWT_SECRET_BYTES, algorithms=JWT_ALGORITHMS, options=JWT_OPTIONS)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
@@ -141,76 +339,156 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user = await db.users.find_one({"id": user_id})
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return User(**user)
+    user = User(**user)
+    user_cache[token] = (user, payload.get("exp", 0))
+    return user
 
 # Auth routes
 @api_router.post("/auth/register", response_model=UserResponse)
 async def register(user_data: UserCreate):
-    # Validate email
+    # Validate email syntax only, the deliverability check does blocking DNS lookups
     try:
-        validate_email(user_data.email)
+        validate_email(user_data.email, check_deliverability=False)
     except EmailNotValidError:
         raise HTTPException(status_code=400, detail="Invalid email format")
     
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create user
-    user_dict = user_data.dict()
-    user_dict['password_hash'] = hash_password(user_dict.pop('password'))
-    user_obj = User(**user_dict)
+    # Create user, the unique email index rejects duplicates
+    user_dict = user_data.model_dump()
+    user_dict['password_hash'] = await run_in_threadpool(hash_password, user_dict.pop('password'))
+    user_doc = User(**user_dict).model_dump()
     
-    await db.users.insert_one(user_obj.dict())
-    return UserResponse(**user_obj.dict())
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    # Already validated above, skip a second validation pass
+    return UserResponse.model_construct(**{field: user_doc[field] for field in USER_RESPONSE_FIELDS})
 
 @api_router.post("/auth/login")
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, background_tasks: BackgroundTasks):
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user['password_hash']):
+    # bcrypt is CPU-bound, keep it off the event loop. Unknown emails are checked
+    # against a dummy hash so both failure paths take the same time.
+    password_hash = user['password_hash'] if user else DUMMY_PASSWORD_HASH
+    password_ok = await run_in_threadpool(verify_password, user_data.password, password_hash)
+    if not user or not password_ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    # Upgrade hashes created with a lower cost factor after the response is sent
+    if needs_rehash(user['password_hash']):
+        background_tasks.add_task(rehash_password, user['id'], user_data.password)
+    
     access_token = create_access_token(data={"sub": user['id']})
-    return {"access_token": access_token, "token_type": "bearer", "user": UserResponse(**user)}
+    user_response = UserResponse.model_construct(**{field: user[field] for field in USER_RESPONSE_FIELDS})
+    return {"access_token": access_token, "token_type": "bearer", "user": user_response}
+
+@api_router.post("/auth/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user)
+):
+    # get_current_user has already verified the token, only its exp is needed here
+    payload = jwt_decoder.decode(
+        credentials.credentials, JWT_SECRET_BYTES, algorithms=JWT_ALGORITHMS, options=JWT_OPTIONS
+    )
+    await revoke_token(credentials.credentials, payload["exp"])
+    return {"message": "Logged out"}
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    return UserResponse(**current_user.dict())
+    return UserResponse.model_construct(**current_user.model_dump(include=USER_RESPONSE_FIELDS))
 
 # Product routes
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, limit: int = 50):
-    query = {"is_active": True}
-    if category:
-        query["category"] = category
+# Listing fields only, full documents are opt-in via ?full=true
+PRODUCT_PROJECTION = {"_id": 0}
+PRODUCT_SUMMARY_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "price": 1, "category": 1, "images": {"$slice": 1}, "stock_quantity": 1
+}
+
+PRODUCT_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match is "*" or a comma-separated list, compared weakly (W/ ignored)
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.removeprefix("W/") == opaque for candidate in candidates)
+
+def apply_cache_headers(request: Request, response: Response, etag: str) -> Optional[Response]:
+    # Returns a 304 response when the client already has this version
+    headers = {"ETag": etag, "Cache-Control": PRODUCT_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Product goes first so full payloads never validate as (and get trimmed to) ProductSummary
+@api_router.get("/products", response_model=Union[List[Product], List[ProductSummary]])
+async def get_products(
+    request: Request,
+    response: Response,
+    category: Optional[Category] = None,
+    limit: int = Query(50, ge=1, le=100),
+    full: bool = False
+):
+    cache_key = f"products:{category.value if category else 'all'}:{limit}:{'full' if full else 'summary'}"
+    entry = await cache_get(cache_key)
+    if entry is None:
+        query = {"is_active": True}
+        if category:
+            query["category"] = category.value
+        
+        projection = PRODUCT_PROJECTION if full else PRODUCT_SUMMARY_PROJECTION
+        products = []
+        async for product in db.products.find(query, projection).batch_size(50).limit(limit):
+            products.append(product)
+        entry = await cache_set(cache_key, products, PRODUCT_LIST_CACHE_TTL_SECONDS, group=PRODUCT_LIST_KEYS)
     
-    products = await db.products.find(query).limit(limit).to_list(limit)
-    return [Product(**product) for product in products]
+    # Raw documents are returned as-is, FastAPI validates them once against the response model
+    return apply_cache_headers(request, response, entry["etag"]) or entry["data"]
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id, "is_active": True})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**product)
+async def get_product(product_id: str, request: Request, response: Response):
+    cache_key = f"product:{product_id}"
+    entry = await cache_get(cache_key)
+    if entry is None:
+        product = await db.products.find_one({"id": product_id, "is_active": True}, PRODUCT_PROJECTION)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        entry = await cache_set(cache_key, product, PRODUCT_CACHE_TTL_SECONDS)
+    
+    return apply_cache_headers(request, response, entry["etag"]) or entry["data"]
 
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate):
-    product_obj = Product(**product_data.dict())
-    await db.products.insert_one(product_obj.dict())
+    product_obj = Product(**product_data.model_dump())
+    await db.products.insert_one(product_obj.model_dump())
+    await invalidate_product_cache(product_obj.id)
     return product_obj
 
 # Cart routes
+# Final pipeline stage shared by cart writes, recomputes the total from the stored items
+CART_TOTAL_STAGE = {"$set": {
+    "total_amount": {"$sum": {"$map": {"input": "$items", "in": {"$multiply": ["$$this.quantity", "$$this.price"]}}}},
+    "updated_at": "$$NOW",
+}}
+
 @api_router.get("/cart", response_model=Cart)
 async def get_cart(current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        # Create empty cart
-        cart_obj = Cart(user_id=current_user.id)
-        await db.carts.insert_one(cart_obj.dict())
-        return cart_obj
-    return Cart(**cart)
+    # Read the cart, creating an empty one in the same write if there is none yet
+    new_cart = Cart(user_id=current_user.id).model_dump()
+    new_cart.pop('user_id')
+    update = dict(upsert=True, return_document=ReturnDocument.AFTER)
+    try:
+        cart = await db.carts.find_one_and_update({"user_id": current_user.id}, {"$setOnInsert": new_cart}, **update)
+    except DuplicateKeyError:
+        # A concurrent request created the cart first, the retry just reads it
+        cart = await db.carts.find_one_and_update({"user_id": current_user.id}, {"$setOnInsert": new_cart}, **update)
+    # FastAPI validates the document against the response model, no need to do it twice
+    return cart
 
 @api_router.post("/cart/add")
 async def add_to_cart(product_id: str, quantity: int = 1, current_user: User = Depends(get_current_user)):
@@ -219,53 +497,51 @@ async def add_to_cart(product_id: str, quantity: int = 1, current_user: User = D
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get or create cart
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        cart_obj = Cart(user_id=current_user.id)
-        cart = cart_obj.dict()
-        await db.carts.insert_one(cart)
-    
-    # Check if item already in cart
-    cart_items = cart.get('items', [])
-    existing_item = None
-    for item in cart_items:
-        if item['product_id'] == product_id:
-            existing_item = item
-            break
-    
-    if existing_item:
-        existing_item['quantity'] += quantity
-    else:
-        cart_items.append({
-            "product_id": product_id,
-            "quantity": quantity,
-            "price": product['price']
-        })
-    
-    # Calculate total
-    total = sum(item['quantity'] * item['price'] for item in cart_items)
-    
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": cart_items, "total_amount": total, "updated_at": datetime.utcnow()}}
+    # Bump the quantity if the product is already in the cart, otherwise append it,
+    # and recompute the total in the same write. Upserts the cart if needed.
+    product_id_literal = {"$literal": product_id}
+    items = {"$ifNull": ["$items", []]}
+    pipeline = [
+        {"$set": {
+            "items": {"$cond": [
+                {"$in": [product_id_literal, {"$map": {"input": items, "in": "$$this.product_id"}}]},
+                {"$map": {"input": items, "in": {"$cond": [
+                    {"$eq": ["$$this.product_id", product_id_literal]},
+                    {"product_id": "$$this.product_id", "quantity": {"$add": ["$$this.quantity", quantity]}, "price": "$$this.price"},
+                    "$$this"
+                ]}}},
+                {"$concatArrays": [items, [{"product_id": product_id_literal, "quantity": quantity, "price": product['price']}]]}
+            ]},
+            "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+            "created_at": {"$ifNull": ["$created_at", "$$NOW"]},
+        }},
+        CART_TOTAL_STAGE,
+    ]
+    update = dict(
+        projection={"items": 1}, upsert=True, return_document=ReturnDocument.AFTER
     )
+    try:
+        cart = await db.carts.find_one_and_update({"user_id": current_user.id}, pipeline, **update)
+    except DuplicateKeyError:
+        # A concurrent request created the cart first, the retry updates it
+        cart = await db.carts.find_one_and_update({"user_id": current_user.id}, pipeline, **update)
     
-    return {"message": "Item added to cart", "total_items": len(cart_items)}
+    return {"message": "Item added to cart", "total_items": len(cart['items'])}
 
 @api_router.delete("/cart/remove/{product_id}")
 async def remove_from_cart(product_id: str, current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    cart_items = [item for item in cart.get('items', []) if item['product_id'] != product_id]
-    total = sum(item['quantity'] * item['price'] for item in cart_items)
-    
-    await db.carts.update_one(
+    result = await db.carts.update_one(
         {"user_id": current_user.id},
-        {"$set": {"items": cart_items, "total_amount": total, "updated_at": datetime.utcnow()}}
+        [
+            {"$set": {"items": {"$filter": {
+                "input": {"$ifNull": ["$items", []]},
+                "cond": {"$ne": ["$$this.product_id", {"$literal": product_id}]}
+            }}}},
+            CART_TOTAL_STAGE,
+        ]
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Cart not found")
     
     return {"message": "Item removed from cart"}
 
@@ -274,25 +550,54 @@ async def remove_from_cart(product_id: str, current_user: User = Depends(get_cur
 async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
     total_amount = sum(item.quantity * item.price for item in order_data.items)
     
-    order_dict = order_data.dict()
+    order_dict = order_data.model_dump()
     order_dict['user_id'] = current_user.id
     order_dict['total_amount'] = total_amount
     order_obj = Order(**order_dict)
     
-    await db.orders.insert_one(order_obj.dict())
+    order_doc = order_obj.model_dump()
+    cart_filter = {"user_id": current_user.id}
+    clear_cart = [{"$set": {"items": [], "total_amount": 0.0, "updated_at": "$$NOW"}}]
     
-    # Clear cart after order
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": [], "total_amount": 0.0, "updated_at": datetime.utcnow()}}
-    )
+    # Place the order and clear the cart atomically where the deployment allows it
+    if mongo_supports_transactions:
+        async def place_order(session):
+            await db.orders.insert_one(order_doc, session=session)
+            await db.carts.update_one(cart_filter, clear_cart, session=session)
+        
+        async with await client.start_session() as session:
+            # Retries on TransientTransactionError and unknown commit results
+            await session.with_transaction(place_order)
+    else:
+        # Standalone servers can't run transactions. Only clear the cart once the
+        # order is stored, so a failed insert never loses the cart.
+        await db.orders.insert_one(order_doc)
+        await db.carts.update_one(cart_filter, clear_cart)
     
     return order_obj
 
 @api_router.get("/orders", response_model=List[Order])
-async def get_user_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.id}).to_list(100)
-    return [Order(**order) for order in orders]
+async def get_user_orders(
+    limit: int = Query(100, ge=1, le=100),
+    before: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Newest first, page through history with ?before=<id of the last order seen>.
+    # Orders sharing a created_at are ordered by id so no page skips or repeats them.
+    query = {"user_id": current_user.id}
+    if before:
+        last = await db.orders.find_one({"id": before, "user_id": current_user.id}, {"created_at": 1})
+        if not last:
+            raise HTTPException(status_code=404, detail="Order not found")
+        query["$or"] = [
+            {"created_at": {"$lt": last['created_at']}},
+            {"created_at": last['created_at'], "id": {"$lt": before}},
+        ]
+    
+    orders = []
+    async for order in db.orders.find(query).sort([("created_at", -1), ("id", -1)]).limit(limit):
+        orders.append(Order(**order))
+    return orders
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str, current_user: User = Depends(get_current_user)):
@@ -398,11 +703,13 @@ async def initialize_sample_data():
         }
     ]
     
-    # Insert products
-    for product_data in sample_products:
-        product_obj = Product(**product_data)
-        await db.products.insert_one(product_obj.dict())
+    # Insert products in a single round trip
+    await db.products.insert_many(
+        [Product(**product_data).model_dump() for product_data in sample_products],
+        ordered=False
+    )
     
+    await invalidate_product_cache()
     return {"message": f"Initialized {len(sample_products)} sample products"}
 
 # Include the router in the main app
@@ -423,6 +730,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def create_unique_index(collection, keys):
+    # Databases from before these indexes may hold duplicates, which must be
+    # cleaned up by hand; the app still starts, just without the constraint
+    try:
+        await collection.create_index(keys, unique=True)
+    except DuplicateKeyError:
+        logger.error(
+            "Duplicate %s values in %s, unique index not created. Remove the duplicates and restart.",
+            keys, collection.name
+        )
+
+@app.on_event("startup")
+async def create_indexes():
+    await create_unique_index(db.users, "email")
+    await create_unique_index(db.users, "id")
+    await create_unique_index(db.products, "id")
+    await db.products.create_index([("is_active", 1), ("category", 1)])
+    await create_unique_index(db.carts, "user_id")
+    await db.orders.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+
+@app.on_event("startup")
+async def detect_transaction_support():
+    global mongo_supports_transactions
+    try:
+        hello = await client.admin.command("hello")
+    except OperationFailure:
+        # hello only exists from MongoDB 4.4.2, older servers answer isMaster
+        try:
+            hello = await client.admin.command("isMaster")
+        except OperationFailure:
+            logger.warning("Could not detect replica set, orders are placed without transactions")
+            return
+    mongo_supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+
+@app.on_event("startup")
+async def start_revocation_listener():
+    global revocation_listener
+    if redis_client is not None:
+        revocation_listener = asyncio.create_task(listen_for_revocations())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    if revocation_listener is not None:
+        revocation_listener.cancel()
+    if redis_client is not None:
+        await redis_client.aclose()
\ No newline at end of file
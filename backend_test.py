@@ -1,6 +1,7 @@
 import requests
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 class HairEcommerceAPITester:
@@ -12,25 +13,39 @@ class HairEcommerceAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.created_product_id = None
+        # Shared session keeps connections alive across tests
+        self.session = requests.Session()
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
-        """Run a single API test"""
+    def send_request(self, method, endpoint, data=None, params=None, extra_headers=None, session=None):
+        """Send a request to the API, returns the response"""
+        session = session or self.session
         url = f"{self.api_url}/{endpoint}"
         headers = {'Content-Type': 'application/json'}
         if self.token:
             headers['Authorization'] = f'Bearer {self.token}'
+        if extra_headers:
+            headers.update(extra_headers)
+
+        if method == 'GET':
+            return session.get(url, headers=headers, params=params)
+        elif method == 'POST':
+            return session.post(url, json=data, headers=headers, params=params)
+        elif method == 'DELETE':
+            return session.delete(url, headers=headers)
+
+    def run_test(self, name, method, endpoint, expected_status, data=None, params=None, response=None):
+        """Run a single API test, checks a pre-fetched response if given"""
+        url = f"{self.api_url}/{endpoint}"
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
         print(f"   URL: {url}")
         
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers, params=params)
-            elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers, params=params)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=headers)
+            if response is None:
+                response = self.send_request(method, endpoint, data=data, params=params)
+            elif isinstance(response, Exception):
+                raise response
 
             success = response.status_code == expected_status
             if success:
@@ -78,20 +93,67 @@ class HairEcommerceAPITester:
             return True
         return success
 
+    def test_get_full_products(self):
+        """Test that full=true returns complete product documents"""
+        success, response = self.run_test(
+            "Get Full Products",
+            "GET",
+            "products",
+            200,
+            params={'full': 'true'}
+        )
+        if success and isinstance(response, list) and len(response) > 0:
+            missing = [p.get('id') for p in response if 'description' not in p]
+            if missing:
+                print(f"❌ Full products missing description: {missing}")
+                return False
+        return success
+
+    def test_products_not_modified(self):
+        """Test that a matching If-None-Match returns 304"""
+        first = self.send_request("GET", "products")
+        etag = first.headers.get('ETag')
+        if not etag:
+            print("❌ No ETag returned for products")
+            return False
+
+        success, _ = self.run_test(
+            "Get Products - Not Modified",
+            "GET",
+            "products",
+            304,
+            response=self.send_request("GET", "products", extra_headers={'If-None-Match': etag})
+        )
+        return success
+
     def test_get_products_by_category(self):
         """Test getting products by category"""
         categories = ['extensions', 'wigs', 'bundles', 'hair_care', 'accessories']
-        for category in categories:
-            success, response = self.run_test(
+
+        def fetch(category):
+            # requests.Session isn't thread-safe, each thread gets its own
+            try:
+                with requests.Session() as session:
+                    return self.send_request("GET", "products", params={'category': category}, session=session)
+            except Exception as e:
+                return e
+
+        # Fire all category requests concurrently, then check them in order
+        with ThreadPoolExecutor(max_workers=len(categories)) as executor:
+            responses = list(executor.map(fetch, categories))
+
+        all_passed = True
+        for category, response in zip(categories, responses):
+            success, _ = self.run_test(
                 f"Get Products - {category}",
                 "GET",
                 "products",
                 200,
-                params={'category': category}
+                params={'category': category},
+                response=response
             )
-            if not success:
-                return False
-        return True
+            all_passed = all_passed and success
+        return all_passed
 
     def test_get_single_product(self):
         """Test getting a single product"""
@@ -251,6 +313,8 @@ def main():
     test_sequence = [
         ("Initialize Sample Data", tester.test_init_data),
         ("Get All Products", tester.test_get_products),
+        ("Get Full Products", tester.test_get_full_products),
+        ("Products Not Modified", tester.test_products_not_modified),
         ("Get Products by Category", tester.test_get_products_by_category),
         ("Get Single Product", tester.test_get_single_product),
         ("User Registration", tester.test_register_user),
@@ -288,7 +288,7 @@ const Home = ({ onAuthClick }) => {
 
   const fetchProducts = async (category = '') => {
     try {
-      const response = await axios.get(`${API}/products${category ? `?category=${category}` : ''}`);
+      const response = await axios.get(`${API}/products`, { params: { full: true, ...(category && { category }) } });
       setProducts(response.data);
     } catch (error) {
       toast({ title: "Error", description: "Failed to fetch products", variant: "destructive" });